@@ -1,5 +1,6 @@
 """Litestar Application for serving and ingesting data."""
 
+import asyncio
 import logging
 import os
 from datetime import datetime, timezone
@@ -25,14 +26,11 @@ from masterbase.guards import (
 )
 from masterbase.lib import (
     DemoSessionManager,
-    SocketManagerMapType,
+    SessionRegistry,
     add_loser,
     add_report,
     async_steam_id_from_api_key,
-    check_is_active,
     check_is_loser,
-    check_is_open,
-    check_key_exists,
     check_steam_id_has_api_key,
     check_steam_id_is_beta_tester,
     close_session_helper,
@@ -42,15 +40,14 @@ from masterbase.lib import (
     generate_uuid4_int,
     late_bytes_helper,
     list_demos_helper,
+    open_streaming_session,
     provision_api_key,
     resolve_hostname,
     set_open_false,
-    set_open_true,
     start_session_helper,
-    steam_id_from_api_key,
     update_api_key,
 )
-from masterbase.models import ExportTable, LateBytesBody, ReportBody
+from masterbase.models import ExportFormat, ExportTable, LateBytesBody, ReportBody
 from masterbase.registers import shutdown_registers, startup_registers
 from masterbase.steam import account_exists, is_limited_account
 
@@ -58,11 +55,11 @@ logger = logging.getLogger(__name__)
 
 
 # use this to ensure client only has one open connection
-streaming_sessions: SocketManagerMapType = {}
+streaming_sessions = SessionRegistry()
 
 
-@get("/session_id", guards=[valid_key_guard, user_in_session_guard, valid_session_guard], sync_to_thread=False)
-def session_id(
+@get("/session_id", guards=[valid_key_guard, user_in_session_guard, valid_session_guard])
+async def session_id(
     request: Request,
     api_key: str,
     demo_name: str,
@@ -80,55 +77,54 @@ def session_id(
         {"session_id": some integer}
     """
     _session_id = generate_uuid4_int()
-    engine = request.app.state.engine
-    steam_id = steam_id_from_api_key(engine, api_key)
+    engine = request.app.state.async_engine
+    steam_id = await async_steam_id_from_api_key(engine, api_key)
 
     fake_ip = unquote(fake_ip)
     if not fake_ip.startswith("169"):
         to_resolve, port = fake_ip.split(":")
-        fake_ip = f"{resolve_hostname(to_resolve)}:{port}"
-    start_session_helper(engine, steam_id, str(_session_id), demo_name, fake_ip, map)
+        fake_ip = f"{await asyncio.to_thread(resolve_hostname, to_resolve)}:{port}"
+    await start_session_helper(engine, steam_id, str(_session_id), demo_name, fake_ip, map)
 
     return {"session_id": _session_id}
 
 
-@get("/close_session", guards=[valid_key_guard, user_not_in_session_guard], sync_to_thread=False)
-def close_session(request: Request, api_key: str) -> dict[str, bool]:
+@get("/close_session", guards=[valid_key_guard, user_not_in_session_guard])
+async def close_session(request: Request, api_key: str) -> dict[str, bool]:
     """Close a session out. Will find the latest open session for a user.
 
     Returns:
         {"closed_successfully": True}
     """
     minio_client = request.app.state.minio_client
-    engine = request.app.state.engine
+    engine = request.app.state.async_engine
 
-    steam_id = steam_id_from_api_key(engine, api_key)
-    msg = close_session_helper(minio_client, engine, steam_id, streaming_sessions)
+    steam_id = await async_steam_id_from_api_key(engine, api_key)
+    msg = await close_session_helper(minio_client, engine, steam_id, streaming_sessions)
     logger.info(msg)
 
     return {"closed_successfully": True}
 
 
-@post("/late_bytes", guards=[valid_key_guard, user_not_in_session_guard], sync_to_thread=False)
-def late_bytes(request: Request, api_key: str, data: LateBytesBody) -> dict[str, bool]:
+@post("/late_bytes", guards=[valid_key_guard, user_not_in_session_guard])
+async def late_bytes(request: Request, api_key: str, data: LateBytesBody) -> dict[str, bool]:
     """Add late bytes to a closed demo session.
 
     Returns:
         {"late_bytes": True}
     """
-    engine = request.app.state.engine
-    current_time = datetime.now().astimezone(timezone.utc)
-    steam_id = steam_id_from_api_key(engine, api_key)
-    converted_late_bytes = bytes.fromhex(data.late_bytes)
-    error = late_bytes_helper(engine, steam_id, converted_late_bytes, current_time)
+    engine = request.app.state.async_engine
+    current_time = datetime.now(timezone.utc)
+    steam_id = await async_steam_id_from_api_key(engine, api_key)
+    error = await late_bytes_helper(engine, steam_id, data.late_bytes, current_time)
     if error is None:
         return {"late_bytes": True}
     else:
         raise HTTPException(detail=error, status_code=422, extra={"late_bytes": False})
 
 
-@get("/analyst_list_demos", guards=[valid_key_guard, analyst_guard], sync_to_thread=False)
-def analyst_list_demos(
+@get("/analyst_list_demos", guards=[valid_key_guard, analyst_guard])
+async def analyst_list_demos(
     request: Request, api_key: str, page_size: int | None = None, page_number: int | None = None
 ) -> list[dict[str, str]]:
     """List all demo data."""
@@ -136,13 +132,13 @@ def analyst_list_demos(
         page_size = 50
     if page_number is None or page_number < 1:
         page_number = 1
-    engine = request.app.state.engine
-    demos = list_demos_helper(engine, api_key, page_size, page_number, analyst=True)
+    engine = request.app.state.async_engine
+    demos = await list_demos_helper(engine, api_key, page_size, page_number, analyst=True)
     return demos
 
 
-@get("/list_demos", guards=[valid_key_guard], sync_to_thread=False)
-def list_demos(
+@get("/list_demos", guards=[valid_key_guard])
+async def list_demos(
     request: Request, api_key: str, page_size: int | None = None, page_number: int | None = None
 ) -> list[dict[str, str]]:
     """List demo data for user with `api_key`."""
@@ -150,8 +146,8 @@ def list_demos(
         page_size = 50
     if page_number is None or page_number < 1:
         page_number = 1
-    engine = request.app.state.engine
-    demos = list_demos_helper(engine, api_key, page_size, page_number, analyst=False)
+    engine = request.app.state.async_engine
+    demos = await list_demos_helper(engine, api_key, page_size, page_number, analyst=False)
     return demos
 
 
@@ -160,8 +156,9 @@ async def demodata(request: Request, api_key: str, session_id: str) -> Stream:
     """Return the demo."""
     minio_client = request.app.state.minio_client
     blob_name = demo_blob_name(session_id)
-    file = minio_client.get_object("demoblobs", blob_name)
-    stat = minio_client.stat_object("demoblobs", blob_name)
+    # stat first, so a missing blob errors out before a response is holding a pooled connection
+    stat = await asyncio.to_thread(minio_client.stat_object, "demoblobs", blob_name)
+    file = await asyncio.to_thread(minio_client.get_object, "demoblobs", blob_name)
 
     headers = {
         "Content-Disposition": f'attachment; filename="{blob_name}"',
@@ -172,14 +169,26 @@ async def demodata(request: Request, api_key: str, session_id: str) -> Stream:
 
 
 @get("/db_export", guards=[valid_key_guard, analyst_guard], sync_to_thread=False)
-def db_export(request: Request, api_key: str, table: ExportTable) -> Stream:
-    """Return a database export of the requested `table`."""
-    engine = request.app.state.engine
-    filename = f"{table.value}-{datetime.now()}.csv"
+def db_export(
+    request: Request,
+    api_key: str,
+    table: ExportTable,
+    format: ExportFormat = ExportFormat.CSV,
+    compress: bool = False,
+) -> Stream:
+    """Return a database export of the requested `table` in `format`, gzipped if `compress`."""
+    engine = request.app.state.async_engine
+    extension, content_type = {
+        ExportFormat.CSV: ("csv", "text/csv"),
+        ExportFormat.BINARY: ("bin", "application/octet-stream"),
+    }[format]
+    if compress:
+        extension, content_type = f"{extension}.gz", "application/gzip"
+    filename = f"{table.value}-{datetime.now()}.{extension}"
     return Stream(
-        lambda: db_export_chunks(engine, table.value),
+        lambda: db_export_chunks(engine, table.value, format, compress),
         headers={
-            "Content-Type": "text/csv",
+            "Content-Type": content_type,
             "Content-Disposition": f"attachment; filename={filename}",
         },
     )
@@ -190,11 +199,11 @@ async def report_player(request: Request, api_key: str, data: ReportBody) -> dic
     """Add a player report."""
     engine = request.app.state.engine
 
-    exists = account_exists(str(data.target_steam_id))
+    exists = await asyncio.to_thread(account_exists, str(data.target_steam_id))
     if not exists:
         raise PermissionDeniedException(detail="Unknown target_steam_id!")
     try:
-        add_report(engine, data.session_id, str(data.target_steam_id), data.reason.value)
+        await asyncio.to_thread(add_report, engine, data.session_id, str(data.target_steam_id), data.reason.value)
         return {"report_added": True}
     except IntegrityError:
         raise HTTPException(detail=f"Unknown session ID {data.session_id}", status_code=402)
@@ -209,23 +218,11 @@ class DemoHandler(WebsocketListener):
     async def on_accept(self, socket: WebSocket, api_key: str, session_id: str) -> None:  # type: ignore
         """Accept a user and create handle."""
         engine = socket.app.state.async_engine
-        exists = await check_key_exists(engine, api_key)
-        if not exists:
-            logger.info("Invalid API key, closing!")
-            await socket.close()
-
-        steam_id = await async_steam_id_from_api_key(engine, api_key)
-        active = await check_is_active(engine, steam_id)
-        if not active:
-            logger.info("User is not in a session, closing!")
+        error = await open_streaming_session(engine, api_key, session_id)
+        if error is not None:
+            logger.info(f"{error}, closing!")
             await socket.close()
-
-        session_open = await check_is_open(engine, steam_id, session_id)
-        if session_open:
-            logger.info("User is already streaming data, closing!")
-            await socket.close()
-
-        await set_open_true(engine, steam_id, session_id)
+            return
 
         session_manager = DemoSessionManager(session_id=session_id, detection_state=DetectionState())
 
@@ -241,16 +238,21 @@ class DemoHandler(WebsocketListener):
 
     async def on_disconnect(self, socket: WebSocket) -> None:  # type: ignore
         """Close handle on disconnect."""
+        if socket not in streaming_sessions:
+            # already flushed and closed out by `/close_session`
+            return
         session_manager = streaming_sessions[socket]
         logger.info(f"Received socket disconnect from session ID: {session_manager.session_id}")
-        session_manager.disconnect()
-        await set_open_false(socket.app.state.async_engine, session_manager.session_id)
+        try:
+            await asyncio.to_thread(session_manager.disconnect)
+        finally:
+            await set_open_false(socket.app.state.async_engine, session_manager.session_id)
 
-    def on_receive(self, data: bytes, socket: WebSocket) -> None:
+    async def on_receive(self, data: bytes, socket: WebSocket) -> None:  # type: ignore
         """Write data on disconnect."""
         session_manager = streaming_sessions[socket]
         logger.info(f"Sinking {len(data)} bytes to {session_manager.session_id}")
-        session_manager.update(data)
+        await session_manager.async_update(data)
 
 
 @get("/provision", sync_to_thread=False)
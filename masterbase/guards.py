@@ -1,5 +1,6 @@
 """Guards for the application."""
 
+import asyncio
 from urllib.parse import unquote
 
 from litestar.connection import ASGIConnection
@@ -7,12 +8,12 @@ from litestar.exceptions import NotAuthorizedException, PermissionDeniedExceptio
 from litestar.handlers.base import BaseRouteHandler
 
 from masterbase.lib import (
+    async_steam_id_from_api_key,
     check_analyst,
     check_is_active,
     check_key_exists,
     resolve_hostname,
     session_closed,
-    steam_id_from_api_key,
 )
 from masterbase.steam import Query, Server, get_ip_as_integer, get_steam_api_key
 
@@ -35,10 +36,9 @@ async def valid_key_guard(connection: ASGIConnection, _: BaseRouteHandler) -> No
 async def analyst_guard(connection: ASGIConnection, _: BaseRouteHandler) -> None:
     """Guard clause to User is an analyst."""
     api_key = connection.query_params["api_key"]
-    engine = connection.app.state.engine
-    steam_id = steam_id_from_api_key(engine, api_key)
-
     async_engine = connection.app.state.async_engine
+    steam_id = await async_steam_id_from_api_key(async_engine, api_key)
+
     exists = await check_analyst(async_engine, steam_id)
     if not exists:
         raise NotAuthorizedException()
@@ -49,8 +49,7 @@ async def user_in_session_guard(connection: ASGIConnection, _: BaseRouteHandler)
     async_engine = connection.app.state.async_engine
 
     api_key = connection.query_params["api_key"]
-    engine = connection.app.state.engine
-    steam_id = steam_id_from_api_key(engine, api_key)
+    steam_id = await async_steam_id_from_api_key(async_engine, api_key)
     is_active = await check_is_active(async_engine, steam_id)
 
     if is_active:
@@ -64,8 +63,7 @@ async def user_not_in_session_guard(connection: ASGIConnection, _: BaseRouteHand
     async_engine = connection.app.state.async_engine
 
     api_key = connection.query_params["api_key"]
-    engine = connection.app.state.engine
-    steam_id = steam_id_from_api_key(engine, api_key)
+    steam_id = await async_steam_id_from_api_key(async_engine, api_key)
     is_active = await check_is_active(async_engine, steam_id)
     if not is_active:
         raise PermissionDeniedException(detail="User is not in a session, create one at `/session_id`!")
@@ -94,13 +92,13 @@ async def valid_session_guard(connection: ASGIConnection, _: BaseRouteHandler) -
         ip, fake_port = fake_ip.split(":")
         converted_fake_ip = get_ip_as_integer(ip)
         try:
-            Server.query_from_params(api_key, converted_fake_ip, fake_port)
+            await Server.async_query_from_params(api_key, converted_fake_ip, fake_port)
         except KeyError:
             raise NotAuthorizedException(f"Cannot accept data from a non-existent gameserver! ({fake_ip})")
     else:
         to_resolve, port = fake_ip.split(":")
-        fake_ip = f"{resolve_hostname(to_resolve)}:{port}"
+        fake_ip = f"{await asyncio.to_thread(resolve_hostname, to_resolve)}:{port}"
         query = Query(api_key, {"gameaddr": fake_ip})
-        servers = query.query()
+        servers = await asyncio.to_thread(query.query)
         if not servers:
             raise NotAuthorizedException(f"Cannot accept data from a non-existent gameserver! ({fake_ip})")
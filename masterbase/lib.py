@@ -1,26 +1,31 @@
 """Library code for application."""
 
+import asyncio
+import base64
 import hashlib
 import io
 import logging
 import os
 import secrets
 import socket
+import time
+import zlib
 from datetime import datetime, timezone
-from queue import Queue
-from threading import Thread
-from typing import IO, Any, BinaryIO, Generator, cast
-from uuid import uuid4
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from typing import IO, Any, AsyncGenerator, BinaryIO, Callable, cast
 
+import certifi
 import sqlalchemy as sa
+import urllib3
 from litestar import WebSocket
 from minio import Minio, S3Error
 from minio.datatypes import Object as BlobStat
 from sqlalchemy import Engine
-from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncEngine
 
 from masterbase.anomaly import DetectionState
+from masterbase.models import ExportFormat
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +35,22 @@ os.makedirs(DEMOS_PATH, exist_ok=True)
 LATE_BYTES_START = 0x420
 LATE_BYTES_END = 0x430
 
+# chunks a demo session may have waiting on its writer thread before the socket handler blocks
+DEMO_WRITE_QUEUE_SIZE = 64
+# buffer demo writes so a stream of websocket frames becomes a few large `write(2)`s
+DEMO_HANDLE_BUFFER_SIZE = 1 << 20
+
+# version and variant bits `uuid.uuid4` sets, applied directly to the random integer
+UUID4_MASK = (0xF000 << 64) | (0xC000 << 48)
+UUID4_BITS = (0x4000 << 64) | (0x8000 << 48)
+
+# seconds a resolved API key is trusted for; the cache is per worker, so this bounds how stale other workers get
+STEAM_ID_CACHE_TTL = 300.0
+STEAM_ID_CACHE_SIZE = 4096
+
+# MinIO connections kept alive per worker; uploads and downloads run on worker threads, so size for the thread pool
+MINIO_POOL_SIZE = 32
+
 
 def resolve_hostname(hostname: str) -> str:
     """Resolve a hostname to an IP."""
@@ -54,44 +75,90 @@ def make_minio_client(is_secure: bool = False) -> Minio:
     host, port, access_key, secret_key = map(
         os.getenv, ("MINIO_HOST", "MINIO_PORT", "MINIO_ACCESS_KEY", "MINIO_SECRET_KEY")
     )
-    return Minio(f"{host}:{port}", access_key=access_key, secret_key=secret_key, secure=is_secure)
+    # the client's default pool as of minio 7.2.20 (`Minio.__init__`), only `maxsize` differs from its cap of 10
+    http_client = urllib3.PoolManager(
+        timeout=urllib3.Timeout(connect=300, read=300),
+        maxsize=MINIO_POOL_SIZE,
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+        retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+    )
+    return Minio(
+        f"{host}:{port}", access_key=access_key, secret_key=secret_key, secure=is_secure, http_client=http_client
+    )
 
 
-def db_export_chunks(engine: Engine, table: str) -> Generator[bytes, None, None]:
-    """Export the given table as an iterable of csv chunks."""
+COPY_OPTIONS: dict[ExportFormat, dict[str, Any]] = {
+    ExportFormat.CSV: {"format": "csv", "delimiter": ",", "header": True},
+    ExportFormat.BINARY: {"format": "binary"},
+}
+# chunks an export may buffer ahead of a slow client before COPY is paused
+DB_EXPORT_QUEUE_SIZE = 64
 
-    class Shunt:
-        def write(self, data):
-            queue.put(data)
 
-    shunt = Shunt()
-    queue: Queue = Queue()
+async def db_export_chunks(
+    engine: AsyncEngine, table: str, export_format: ExportFormat = ExportFormat.CSV, compress: bool = False
+) -> AsyncGenerator[bytes, None]:
+    """Export the given table as an async iterable of chunks in `export_format`, gzipped if `compress`.
 
-    shunt = Shunt()
+    asyncpg pushes COPY output into a callback, so it is handed over through a bounded queue on the event loop:
+    no extra thread, and a slow client pauses the COPY instead of buffering the whole table.
+    """
+    # level 1 gets most of the ratio on table dumps at close to memcpy speed
+    compressor = zlib.compressobj(1, zlib.DEFLATED, zlib.MAX_WBITS | 16) if compress else None
+    chunks: asyncio.Queue[bytes | Exception | None] = asyncio.Queue(maxsize=DB_EXPORT_QUEUE_SIZE)
+
+    async def sink(data: bytes | bytearray) -> None:
+        # asyncpg reuses its own buffer, so take a copy before it is handed to the response
+        data = compressor.compress(data) if compressor is not None else bytes(data)
+        if data:
+            await chunks.put(data)
 
-    def worker():
+    async def copy() -> None:
         try:
-            with engine.connect() as txn:
-                cursor = txn.connection.dbapi_connection.cursor()
-                cursor.copy_expert(f"COPY {table} TO STDOUT DELIMITER ',' CSV HEADER", shunt)
-                queue.put(b"")
+            async with engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                driver_connection = cast(Any, raw.driver_connection)
+                await driver_connection.copy_from_table(table, output=sink, **COPY_OPTIONS[export_format])
+            if compressor is not None:
+                await chunks.put(compressor.flush())
+            await chunks.put(None)
         except Exception as err:
-            queue.put(err)
+            await chunks.put(err)
 
-    Thread(target=worker).start()
-    for x in iter(queue.get, b""):
-        if isinstance(x, Exception):
-            raise x
-        yield x
+    task = asyncio.create_task(copy())
+    try:
+        while (chunk := await chunks.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        # no-op once the COPY finished, otherwise the client went away mid-export
+        task.cancel()
 
 
 class ConcatStream:
     """Concat multiple filestreams."""
 
-    def __init__(self, *streams: IO[bytes]) -> None:
+    def __init__(self, *streams: io.BufferedIOBase) -> None:
         """Initialize the ConcatStream with multiple streams."""
         self.streams = iter(streams)
-        self.current: IO[bytes] | None = next(self.streams, None)
+        self.current: io.BufferedIOBase | None = next(self.streams, None)
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:
+        """Read from the concatenated streams into `buffer`, returning the number of bytes read.
+
+        The buffer is only left partially filled once every stream is exhausted.
+        """
+        view = memoryview(buffer)
+        head = 0
+        while head < len(view) and self.current is not None:
+            read = self.current.readinto(view[head:])
+            if read:
+                head += read
+            else:
+                self.current = next(self.streams, None)
+        return head
 
     def read(self, size: int = -1) -> bytes:
         """Read from the concatenated streams."""
@@ -103,24 +170,28 @@ class ConcatStream:
             data += self.current.read()
             data += b"".join(s.read() for s in self.streams)
             self.current = None
-            return data
+            return bytes(data)
 
         data = bytearray(size)
-        head = 0
-        while size > 0 and self.current is not None:
-            read = self.current.read(size)
-            if read == b"":
-                self.current = next(self.streams, None)
-            else:
-                data[head : head + len(read)] = read
-                head += len(read)
-                size -= len(read)
-        return bytes(data[:head])
+        del data[self.readinto(data) :]
+        return bytes(data)
 
 
 class DemoSessionManager:
     """Helper class to facilitate access."""
 
+    __slots__ = (
+        "session_id",
+        "detection_state",
+        "chunk_count",
+        "handle",
+        "_writes",
+        "_writer",
+        "_write_error",
+        "_closed",
+        "_lock",
+    )
+
     def __init__(self, session_id: str, detection_state: DetectionState) -> None:
         """Create a demo session manager.
 
@@ -131,6 +202,12 @@ class DemoSessionManager:
         self.session_id = session_id
         self.detection_state = detection_state
         self.chunk_count = 0
+        self._writes: Queue[bytes | None] = Queue(maxsize=DEMO_WRITE_QUEUE_SIZE)
+        self._writer: Thread | None = None
+        self._write_error: OSError | None = None
+        # guards `_closed` so nothing is queued behind the `None` sentinel and only one sentinel is sent
+        self._closed = False
+        self._lock = Lock()
 
     @property
     def demo_path(self) -> str:
@@ -138,24 +215,171 @@ class DemoSessionManager:
         return demo_sink_path(self.session_id)
 
     def set_demo_handle(self, mode: str) -> None:
-        """Open a handle with the mode at `self.demo_path`."""
-        self.handle = open(self.demo_path, mode)
+        """Open a handle with the mode at `self.demo_path` and start writing queued data to it."""
+        self.handle = open(self.demo_path, mode, buffering=DEMO_HANDLE_BUFFER_SIZE)
+        self._writer = Thread(target=self._drain_writes, daemon=True)
+        self._writer.start()
+
+    def _drain_writes(self) -> None:
+        """Write queued chunks to the handle until the `None` sentinel is received."""
+        while True:
+            batch = [self._writes.get()]
+            # coalesce whatever else has queued up while we were writing
+            while batch[-1] is not None:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except Empty:
+                    break
+            done = batch[-1] is None
+            if done:
+                batch.pop()
+            # keep draining after a failure so the socket handler never blocks on a dead writer
+            if self._write_error is None:
+                try:
+                    self.handle.writelines(cast(list[bytes], batch))
+                except OSError as err:
+                    self._write_error = err
+            if done:
+                return
+
+    def _put(self, data: bytes, block: bool) -> bool:
+        """Queue data for the writer, returning False instead of waiting when `block` is false and it is behind.
+
+        Raises if the session was disconnected, as the writer no longer drains the queue.
+        """
+        if not self._lock.acquire(blocking=block):
+            return False
+        try:
+            if self._closed:
+                raise ValueError(f"Demo session {self.session_id} is closed")
+            try:
+                self._writes.put(data, block=block)
+            except Full:
+                return False
+            return True
+        finally:
+            self._lock.release()
 
     def update(self, data: bytes) -> None:
-        """Write data to both blob storage and state objects."""
-        self.handle.write(data)
+        """Queue data for the demo sink and update state objects, blocking while the writer is behind."""
+        if self._write_error is not None:
+            raise self._write_error
+        self._put(data, block=True)
+        self.detection_state.update(data)
+
+    async def async_update(self, data: bytes) -> None:
+        """Queue data for the demo sink and update state objects, waiting off the event loop while the writer is behind."""  # noqa
+        if self._write_error is not None:
+            raise self._write_error
+        if not self._put(data, block=False):
+            await asyncio.to_thread(self._put, data, True)
         self.detection_state.update(data)
 
     def disconnect(self) -> None:
-        """Close objects and consolidate data."""
+        """Flush queued data, close objects and consolidate data.
+
+        Safe to call more than once, and from more than one thread; every call returns once the demo is on disk.
+        A failed write is logged rather than raised so callers can still release the session.
+        """
+        with self._lock:
+            closing = not self._closed
+            self._closed = True
+            if closing and self._writer is not None:
+                self._writes.put(None)
+        if self._writer is not None:
+            self._writer.join()
         self.handle.close()
+        if closing and self._write_error is not None:
+            logger.error(f"Failed writing demo for session ID: {self.session_id}", exc_info=self._write_error)
+
+
+class SessionRegistry:
+    """Map sockets to their session managers, with a reverse index on session ID.
+
+    Both mappings are updated together so closing a session is a single lookup instead of a scan.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty registry."""
+        self._managers: dict[WebSocket, DemoSessionManager] = {}
+        self._sockets: dict[str, WebSocket] = {}
+
+    def __getitem__(self, socket: WebSocket) -> DemoSessionManager:
+        """Get the session manager streaming over `socket`."""
+        return self._managers[socket]
+
+    def __setitem__(self, socket: WebSocket, session_manager: DemoSessionManager) -> None:
+        """Register `session_manager` as streaming over `socket`."""
+        if socket in self._managers:
+            self.pop(socket)
+        self._managers[socket] = session_manager
+        self._sockets[session_manager.session_id] = socket
+
+    def __contains__(self, socket: object) -> bool:
+        """Determine if `socket` is registered."""
+        return socket in self._managers
+
+    def __len__(self) -> int:
+        """Count the registered sessions."""
+        return len(self._managers)
+
+    def pop(self, socket: WebSocket) -> DemoSessionManager:
+        """Unregister `socket` and return its session manager."""
+        session_manager = self._managers.pop(socket)
+        if self._sockets.get(session_manager.session_id) is socket:
+            del self._sockets[session_manager.session_id]
+        return session_manager
+
+    def get_by_session_id(self, session_id: str) -> tuple[WebSocket, DemoSessionManager] | None:
+        """Find the socket and session manager for `session_id`, if it is streaming."""
+        socket = self._sockets.get(session_id)
+        if socket is None:
+            return None
+        return socket, self._managers[socket]
 
 
-SocketManagerMapType = dict[WebSocket, DemoSessionManager]
+class SteamIDCache:
+    """Bounded, expiring cache of API key to steam ID lookups."""
+
+    def __init__(self, ttl: float = STEAM_ID_CACHE_TTL, maxsize: int = STEAM_ID_CACHE_SIZE) -> None:
+        """Create an empty cache whose entries live for `ttl` seconds."""
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: dict[str, tuple[float, str]] = {}
+
+    def get(self, api_key: str) -> str | None:
+        """Get the cached steam ID for `api_key`, if it has not expired."""
+        entry = self._entries.get(api_key)
+        if entry is None:
+            return None
+        expires, steam_id = entry
+        if expires <= time.monotonic():
+            self._entries.pop(api_key, None)
+            return None
+        return steam_id
+
+    def set(self, api_key: str, steam_id: str) -> None:
+        """Cache the steam ID for `api_key`, evicting the oldest entry if full."""
+        if len(self._entries) >= self.maxsize and api_key not in self._entries:
+            self._entries.pop(next(iter(self._entries)), None)
+        self._entries[api_key] = (time.monotonic() + self.ttl, steam_id)
+
+    def invalidate(self, steam_id: str) -> None:
+        """Forget every API key cached for `steam_id`."""
+        for api_key, (_, cached_steam_id) in list(self._entries.items()):
+            if cached_steam_id == steam_id:
+                self._entries.pop(api_key, None)
+
+
+steam_id_cache = SteamIDCache()
 
 
 def steam_id_from_api_key(engine: Engine, api_key: str) -> str:
     """Resolve a steam ID from an  API key."""
+    steam_id = steam_id_cache.get(api_key)
+    if steam_id is not None:
+        return steam_id
+
     with engine.connect() as conn:
         steam_id = conn.execute(
             # should use a CTE here...
@@ -163,11 +387,16 @@ def steam_id_from_api_key(engine: Engine, api_key: str) -> str:
             {"api_key": api_key},
         ).scalar_one()
 
+    steam_id_cache.set(api_key, steam_id)
     return steam_id
 
 
 async def async_steam_id_from_api_key(engine: AsyncEngine, api_key: str) -> str:
     """Resolve a steam ID from an  API key."""
+    steam_id = steam_id_cache.get(api_key)
+    if steam_id is not None:
+        return steam_id
+
     async with engine.connect() as conn:
         result = await conn.execute(
             # should use a CTE here...
@@ -176,31 +405,18 @@ async def async_steam_id_from_api_key(engine: AsyncEngine, api_key: str) -> str:
         )
         steam_id = result.scalar_one()
 
+    steam_id_cache.set(api_key, steam_id)
     return steam_id
 
 
-def _get_latest_session_id(engine: Engine, steam_id: str) -> str | None:
-    """Get the latest session_id for a user."""
-    with engine.connect() as conn:
-        latest_session_id = conn.execute(
-            # should use a CTE here...
-            sa.text(
-                "SELECT session_id FROM demo_sessions WHERE start_time = (SELECT MAX(start_time) FROM demo_sessions WHERE steam_id = :steam_id);"  # noqa
-            ),
-            {"steam_id": steam_id},
-        ).scalar_one_or_none()
-
-    return latest_session_id
-
-
 def generate_uuid4_int() -> int:
     """Seems useless, but makes testing easier."""
-    return uuid4().int
+    return (int.from_bytes(secrets.token_bytes(16), "big") & ~UUID4_MASK) | UUID4_BITS
 
 
 def generate_api_key() -> str:
     """Generate an API key."""
-    return f"MB-{secrets.token_urlsafe(32)}"
+    return "MB-" + base64.urlsafe_b64encode(secrets.token_bytes(32)).rstrip(b"=").decode("ascii")
 
 
 def session_id_from_handle(handle: IO) -> str:
@@ -210,18 +426,16 @@ def session_id_from_handle(handle: IO) -> str:
 
 async def check_key_exists(engine: AsyncEngine, api_key: str) -> bool:
     """Determine key existence."""
+    sql = "SELECT EXISTS (SELECT 1 FROM api_keys WHERE api_key = :api_key);"
     async with engine.connect() as conn:
-        result = await conn.execute(sa.text("SELECT * FROM api_keys WHERE api_key = :api_key"), {"api_key": api_key})
-        data = result.all()
-        if not data:
-            return False
+        result = await conn.execute(sa.text(sql), {"api_key": api_key})
 
-        return True
+        return result.scalar_one()
 
 
 async def check_is_active(engine: AsyncEngine, steam_id: str) -> bool:
     """Determine if a user is in an active session."""
-    sql = "SELECT * FROM demo_sessions WHERE steam_id = :steam_id and active = true;"
+    sql = "SELECT EXISTS (SELECT 1 FROM demo_sessions WHERE steam_id = :steam_id and active = true);"
     params = {"steam_id": steam_id}
 
     async with engine.connect() as conn:
@@ -230,40 +444,56 @@ async def check_is_active(engine: AsyncEngine, steam_id: str) -> bool:
             params,
         )
 
-        data = result.all()
-        is_active = bool(data)
+        is_active = result.scalar_one()
 
         return is_active
 
 
-async def check_is_open(engine: AsyncEngine, steam_id: str, session_id: str) -> bool:
-    """Determine if a user is streaming data."""
-    sql = "SELECT open FROM demo_sessions WHERE steam_id = :steam_id and session_id = :session_id;"
-    params = {"steam_id": steam_id, "session_id": session_id}
+async def open_streaming_session(engine: AsyncEngine, api_key: str, session_id: str) -> str | None:
+    """Mark a session as being streamed to, checking the key and session in the same round trip.
 
-    async with engine.connect() as conn:
-        result = await conn.execute(
-            sa.text(sql),
-            params,
+    No-ops and returns an error message if the key is unknown, the user is not in a session, or the session is
+    already being streamed to.
+    """
+    sql = """
+        WITH requester AS (
+            SELECT steam_id FROM api_keys WHERE api_key = :api_key
+        ), opened AS (
+            UPDATE demo_sessions
+            SET open = true
+            FROM requester
+            WHERE demo_sessions.steam_id = requester.steam_id
+            AND demo_sessions.session_id = :session_id
+            AND demo_sessions.active = true
+            AND demo_sessions.open IS NOT TRUE
+            RETURNING demo_sessions.session_id
         )
-
-        data = result.scalar_one_or_none()
-        is_open = bool(data)
-
-        return is_open
-
-
-async def set_open_true(engine: AsyncEngine, steam_id: str, session_id: str) -> None:
-    """Set `open` to true, indicating the user is streaming data."""
-    sql = "UPDATE demo_sessions SET open = true WHERE steam_id = :steam_id and session_id = :session_id;"
-    params = {"steam_id": steam_id, "session_id": session_id}
+        SELECT
+            EXISTS (SELECT 1 FROM requester) AS key_exists,
+            EXISTS (
+                SELECT 1 FROM demo_sessions, requester
+                WHERE demo_sessions.steam_id = requester.steam_id AND demo_sessions.active = true
+            ) AS is_active,
+            EXISTS (SELECT 1 FROM opened) AS is_opened
+        ;
+    """
+    params = {"api_key": api_key, "session_id": session_id}
 
     async with engine.connect() as conn:
-        await conn.execute(
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        result = await conn.execute(
             sa.text(sql),
             params,
         )
-        await conn.commit()
+        key_exists, is_active, is_opened = result.one()
+
+    if not key_exists:
+        return "Invalid API key"
+    if not is_active:
+        return "User is not in a session"
+    if not is_opened:
+        return "User is already streaming data"
+    return None
 
 
 async def set_open_false(engine: AsyncEngine, session_id: str) -> None:
@@ -272,23 +502,24 @@ async def set_open_false(engine: AsyncEngine, session_id: str) -> None:
     params = {"session_id": session_id}
 
     async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
         await conn.execute(
             sa.text(sql),
             params,
         )
-        await conn.commit()
 
 
 async def check_analyst(engine: AsyncEngine, steam_id: str) -> bool:
     """Determine if a user is in an analyst."""
     sql = """
-        SELECT
-            *
-        FROM
-            analyst_steam_ids
-        WHERE
-            steam_id = :steam_id
-        ;
+        SELECT EXISTS (
+            SELECT
+                1
+            FROM
+                analyst_steam_ids
+            WHERE
+                steam_id = :steam_id
+        );
     """
     params = {"steam_id": steam_id}
 
@@ -298,8 +529,7 @@ async def check_analyst(engine: AsyncEngine, steam_id: str) -> bool:
             params,
         )
 
-        result = _result.one_or_none()
-        analyst = True if result is not None else False
+        analyst = _result.scalar_one()
 
         return analyst
 
@@ -321,12 +551,14 @@ async def session_closed(engine: AsyncEngine, session_id: str) -> bool:
         return closed
 
 
-def start_session_helper(
-    engine: Engine, steam_id: str, session_id: str, demo_name: str, fake_ip: str, map_str: str
+async def start_session_helper(
+    engine: AsyncEngine, steam_id: str, session_id: str, demo_name: str, fake_ip: str, map_str: str
 ) -> None:
     """Start a session and persist to DB."""
-    with engine.connect() as conn:
-        conn.execute(
+    now = datetime.now(timezone.utc)
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(
             sa.text(
                 """INSERT INTO demo_sessions (
                     steam_id,
@@ -365,149 +597,187 @@ def start_session_helper(
                 "demo_name": demo_name,
                 "active": True,
                 "open": False,
-                "start_time": datetime.now().astimezone(timezone.utc).isoformat(),
+                "start_time": now,
                 "end_time": None,
                 "fake_ip": fake_ip,
                 "map": map_str,
                 "steam_api_data": None,
                 "ingested": False,
-                "created_at": datetime.now().astimezone(timezone.utc).isoformat(),
-                "updated_at": datetime.now().astimezone(timezone.utc).isoformat(),
+                "created_at": now,
+                "updated_at": now,
             },
         )
-        conn.commit()
 
 
-def _close_session_without_demo(engine: Engine, steam_id: str, current_time: datetime) -> None:
-    """Close out a session in the DB."""
-    with engine.connect() as conn:
-        conn.execute(
-            sa.text(
-                """UPDATE demo_sessions
-                SET
-                active = False,
-                open = False,
-                end_time = :end_time,
-                updated_at = :updated_at
-                WHERE
-                active = True AND
-                steam_id = :steam_id;"""
-            ),
-            {
-                "steam_id": steam_id,
-                "end_time": current_time.isoformat(),
-                "updated_at": current_time.isoformat(),
-            },
+async def _close_latest_session(
+    engine: AsyncEngine, steam_id: str, current_time: datetime
+) -> tuple[str, bytes | None] | None:
+    """Close out the latest active session in the DB, returning its session ID and late bytes."""
+    sql = """
+        WITH latest AS (
+            SELECT session_id FROM demo_sessions
+            WHERE
+            steam_id = :steam_id AND
+            active = True
+            ORDER BY start_time DESC
+            LIMIT 1
+            FOR UPDATE
         )
-        conn.commit()
+        UPDATE demo_sessions
+        SET
+        active = False,
+        open = False,
+        end_time = :end_time,
+        updated_at = :updated_at
+        FROM latest
+        WHERE demo_sessions.session_id = latest.session_id
+        RETURNING demo_sessions.session_id, demo_sessions.late_bytes;
+    """
+    params = {"steam_id": steam_id, "end_time": current_time, "updated_at": current_time}
 
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        result = await conn.execute(sa.text(sql), params)
+        row = result.one_or_none()
 
-def _close_session_with_demo(
-    minio_client: Minio,
-    engine: Engine,
-    steam_id: str,
-    session_id: str,
-    current_time: datetime,
-    markov_score: float,
-) -> None:
-    """Close out a session in the DB, sink to MinIO."""
+    return None if row is None else (row.session_id, row.late_bytes)
+
+
+def _upload_demo(minio_client: Minio, session_id: str, late_bytes: bytes | None, size: int) -> None:
+    """Sink a demo to MinIO, splicing in its late bytes if there are any."""
     sink_path = demo_sink_path(session_id)
+    if late_bytes is not None:
+        with open(sink_path, "rb") as sink:
+            late = io.BytesIO(late_bytes)
+            head = io.BytesIO(sink.read(LATE_BYTES_START))
+            sink.seek(LATE_BYTES_END, os.SEEK_SET)
+            minio_client.put_object(
+                "demoblobs",
+                demo_blob_name(session_id),
+                data=cast(BinaryIO, ConcatStream(head, late, sink)),
+                length=size,
+                metadata={"has_late_bytes": str(bool(late_bytes))},
+            )
+    else:
+        minio_client.fput_object("demoblobs", demo_blob_name(session_id), file_path=sink_path)
+
+
+async def _set_markov_score(engine: AsyncEngine, session_id: str, markov_score: float) -> None:
+    """Score a closed session's demo ahead of its upload; a score without a `blob_name` marks an upload to retry."""
+    sql = "UPDATE demo_sessions SET markov_score = :markov_score WHERE session_id = :session_id;"
+    params = {"session_id": session_id, "markov_score": markov_score}
+
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(sa.text(sql), params)
+
+
+async def _set_demo_metadata(engine: AsyncEngine, session_id: str, current_time: datetime, size: int) -> None:
+    """Record an uploaded demo on its session; `blob_name` is only set once the blob exists."""
+    sql = """
+        UPDATE demo_sessions
+        SET
+        demo_size = :demo_size,
+        updated_at = :updated_at,
+        blob_name = :blob_name
+        WHERE
+        session_id = :session_id;
+    """
+    params = {
+        "session_id": session_id,
+        "updated_at": current_time,
+        "demo_size": size,
+        "blob_name": demo_blob_name(session_id),
+    }
+
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(sa.text(sql), params)
+
+
+async def _pending_demos(engine: AsyncEngine, steam_id: str) -> list[tuple[str, bytes | None]]:
+    """Get the closed sessions of a user whose demo was scored but never made it to blob storage."""
+    sql = """
+        SELECT session_id, late_bytes FROM demo_sessions
+        WHERE
+        steam_id = :steam_id AND
+        active = False AND
+        markov_score IS NOT NULL AND
+        blob_name IS NULL;
+    """
+    params = {"steam_id": steam_id}
+
+    async with engine.connect() as conn:
+        result = await conn.execute(sa.text(sql), params)
+
+    return [(row.session_id, row.late_bytes) for row in result.all()]
+
+
+async def _store_demo(
+    minio_client: Minio, engine: AsyncEngine, session_id: str, late_bytes: bytes | None, current_time: datetime
+) -> bool:
+    """Upload a closed session's demo from disk and record it, returning False if there is no demo on disk.
+
+    The demo is only removed from disk once it is recorded, so a failure along the way can be retried.
+    """
+    sink_path = demo_sink_path(session_id)
+    if not os.path.exists(sink_path):
+        return False
+
     size = os.stat(sink_path).st_size
-    with engine.connect() as conn:
-        late_bytes = conn.execute(
-            sa.text(
-                """UPDATE demo_sessions
-                SET
-                active = False,
-                open = False,
-                end_time = :end_time,
-                demo_size = :demo_size,
-                markov_score = :markov_score,
-                updated_at = :updated_at,
-                blob_name = :blob_name
-                WHERE
-                steam_id = :steam_id AND
-                session_id = :session_id
-                RETURNING late_bytes;
-                """
-            ),
-            {
-                "steam_id": steam_id,
-                "session_id": session_id,
-                "end_time": current_time.isoformat(),
-                "updated_at": current_time.isoformat(),
-                "demo_size": size,
-                "markov_score": markov_score,
-                "blob_name": demo_blob_name(session_id),
-            },
-        ).scalar_one()
-        if late_bytes is not None:
-            with open(sink_path, "rb") as sink:
-                late = io.BytesIO(late_bytes)
-                head = io.BytesIO(sink.read(LATE_BYTES_START))
-                sink.seek(LATE_BYTES_END, os.SEEK_SET)
-                minio_client.put_object(
-                    "demoblobs",
-                    demo_blob_name(session_id),
-                    data=cast(BinaryIO, ConcatStream(head, late, sink)),
-                    length=size,
-                    metadata={"has_late_bytes": str(bool(late_bytes))},
-                )
-        else:
-            minio_client.fput_object("demoblobs", demo_blob_name(session_id), file_path=sink_path)
-        conn.commit()
+    await asyncio.to_thread(_upload_demo, minio_client, session_id, late_bytes, size)
+    await _set_demo_metadata(engine, session_id, current_time, size)
+    os.remove(sink_path)
+    return True
 
 
-def close_session_helper(
-    minio_client: Minio, engine: Engine, steam_id: str, streaming_sessions: SocketManagerMapType
+async def close_session_helper(
+    minio_client: Minio, engine: AsyncEngine, steam_id: str, streaming_sessions: SessionRegistry
 ) -> str:
     """Properly close a session and return a summary message.
 
+    Demos whose upload failed on an earlier close are retried first, so a failure there leaves the current session
+    active and the close can be retried.
+
     Args:
+        minio_client: client for blob storage
         engine: Engine for the DB
         steam_id: steam id of the user
-        streaming_sessions: dict of active sessions being streamed to
+        streaming_sessions: registry of active sessions being streamed to
 
     Returns:
         status message on what happened
     """
-    latest_session_id = _get_latest_session_id(engine, steam_id)
-    if latest_session_id is None:
-        return "User has never been in a session!"
+    current_time = datetime.now(timezone.utc)
+    for pending_session_id, pending_late_bytes in await _pending_demos(engine, steam_id):
+        await _store_demo(minio_client, engine, pending_session_id, pending_late_bytes, current_time)
+
+    closed = await _close_latest_session(engine, steam_id, current_time)
+    if closed is None:
+        return "No active session found."
+    session_id, late_bytes = closed
 
     # find session manager and socket/key...
-    session_manager = None
-    socket = None
-    for _socket in streaming_sessions:
-        if streaming_sessions[_socket].session_id == latest_session_id:
-            session_manager = streaming_sessions[_socket]
-            socket = _socket
-
-    current_time = datetime.now().astimezone(timezone.utc)
-
-    if session_manager is None:
-        _close_session_without_demo(engine, steam_id, current_time)
-        msg = "No active session found, closing anyway."
-    else:
+    streaming = streaming_sessions.get_by_session_id(session_id)
+    if streaming is None:
+        return "Active session was closed, no demo was streamed."
+    socket, session_manager = streaming
+
+    try:
+        # the socket may still be streaming, so get everything queued onto disk before it is uploaded
+        await asyncio.to_thread(session_manager.disconnect)
+
         if os.path.exists(session_manager.demo_path):
-            _close_session_with_demo(
-                minio_client,
-                engine,
-                steam_id,
-                latest_session_id,
-                current_time,
-                session_manager.detection_state.likelihood,
-            )
-            os.remove(session_manager.demo_path)
+            await _set_markov_score(engine, session_id, session_manager.detection_state.likelihood)
+            await _store_demo(minio_client, engine, session_id, late_bytes, current_time)
             msg = "Active session was closed, demo inserted."
 
-        # we found no session but did find a demo
+        # we found the session's manager but no demo
         else:
-            os.remove(session_manager.demo_path)
-            msg = f"Found orphaned session and demo at {session_manager.demo_path} and removed."
+            msg = f"Found orphaned session with no demo at {session_manager.demo_path}."
 
-    # remove session from active sessions
-    if socket is not None:
+    finally:
+        # remove session from active sessions, a failed upload is retried from disk on the next close
         streaming_sessions.pop(socket)
 
     return msg
@@ -534,8 +804,8 @@ def stat_demo_blob(minio_client: Minio, session_id: str) -> BlobStat | None:
             raise
 
 
-def late_bytes_helper(
-    engine: Engine,
+async def late_bytes_helper(
+    engine: AsyncEngine,
     steam_id: str,
     late_bytes: bytes,
     current_time: datetime,
@@ -544,36 +814,39 @@ def late_bytes_helper(
 
     No-ops and returns an error message if late bytes are found or there are no active sessions.
     """
-    with engine.connect() as conn:
-        try:
-            session_id, old_late_bytes = conn.execute(
-                sa.text(
-                    """SELECT session_id, late_bytes FROM demo_sessions
-                    WHERE active = True
-                    AND steam_id = :steam_id;
-                    """,
-                ),
-                {"steam_id": steam_id},
-            ).one()
-        except NoResultFound:
-            return "no active session"
-        if session_id and old_late_bytes:
-            return "already submitted"
-        conn.execute(
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # lock the active session, and only write late bytes to it if none were submitted yet
+        result = await conn.execute(
             sa.text(
-                """UPDATE demo_sessions
+                """WITH active_session AS (
+                    SELECT session_id, late_bytes IS NOT NULL AS submitted FROM demo_sessions
+                    WHERE active = True
+                    AND steam_id = :steam_id
+                    FOR UPDATE
+                ), updated AS (
+                    UPDATE demo_sessions
                     SET
                     late_bytes = :late_bytes,
                     updated_at = :updated_at
-                    WHERE session_id = session_id;"""
+                    FROM active_session
+                    WHERE demo_sessions.session_id = active_session.session_id
+                    AND NOT active_session.submitted
+                )
+                SELECT submitted FROM active_session;
+                """
             ),
             {
-                "session_id": session_id,
+                "steam_id": steam_id,
                 "late_bytes": late_bytes,
-                "updated_at": current_time.isoformat(),
+                "updated_at": current_time,
             },
         )
-        conn.commit()
+        submitted = result.scalar_one_or_none()
+        if submitted is None:
+            return "no active session"
+        if submitted:
+            return "already submitted"
         return None
 
 
@@ -587,23 +860,48 @@ async def get_demo_size(engine: AsyncEngine, session_id: str) -> str:
         return str(size)
 
 
-def list_demos_helper(
-    engine: Engine, api_key: str, page_size: int, page_number: int, analyst: bool
+def anonymizer(requester_key: bytes) -> Callable[[str], str]:
+    """Make a function anonymizing demo owners' steam IDs for one requester.
+
+    The hash is keyed on the requester so IDs do not correlate across requesters. The key block is only
+    compressed once here; each call copies the keyed state and hashes just the steam ID.
+    """
+    keyed = hashlib.blake2b(key=requester_key, digest_size=16)
+
+    def anonymize(steam_id: str) -> str:
+        digest = keyed.copy()
+        digest.update(steam_id.encode())
+        return digest.hexdigest()
+
+    return anonymize
+
+
+async def list_demos_helper(
+    engine: AsyncEngine, api_key: str, page_size: int, page_number: int, analyst: bool
 ) -> list[dict[str, Any]]:
     """List demos in the DB for a user with pagination."""
-    requester_steam_id = steam_id_from_api_key(engine, api_key)
     offset = (page_number - 1) * page_size
-    params: dict[str, Any] = {"page_size": page_size, "offset": offset}
-    where = "active = false"
+    params: dict[str, Any] = {"api_key": api_key, "page_size": page_size, "offset": offset}
+    where = "demo_sessions.active = false"
     if not analyst:
-        where = f"{where} AND steam_id = :steam_id"
-        params["steam_id"] = requester_steam_id
+        where = f"{where} AND demo_sessions.steam_id = requester.steam_id"
 
+    # resolve the requester in the same round trip as the page
     sql = f"""
+    WITH requester AS (
+        SELECT steam_id FROM api_keys WHERE api_key = :api_key
+    )
     SELECT
-        steam_id, demo_name, session_id, map, start_time, end_time, demo_size
+        requester.steam_id AS requester_steam_id,
+        demo_sessions.steam_id,
+        demo_name,
+        session_id,
+        map,
+        start_time,
+        end_time,
+        demo_size
     FROM
-        demo_sessions
+        demo_sessions, requester
     WHERE
         {where}
     ORDER BY
@@ -612,16 +910,19 @@ def list_demos_helper(
     ;
     """
 
-    with engine.connect() as conn:
-        data = conn.execute(sa.text(sql), params)
+    async with engine.connect() as conn:
+        data = await conn.execute(sa.text(sql), params)
 
     rows = [row._asdict() for row in data.all()]
+    if not rows:
+        return rows
+
+    # every row carries the same requester
+    anonymize = anonymizer(rows[0]["requester_steam_id"].encode())
     # modify in place
     for row in rows:
-        demo_steam_id = row["steam_id"]
-        to_hash = f"{demo_steam_id}{requester_steam_id}"
-        row["anonymous_id"] = hashlib.sha256(to_hash.encode()).hexdigest()
-        row.pop("steam_id")
+        del row["requester_steam_id"]
+        row["anonymous_id"] = anonymize(row.pop("steam_id"))
 
     return rows
 
@@ -638,28 +939,29 @@ def check_steam_id_has_api_key(engine: Engine, steam_id: str) -> str | None:
 
 def update_api_key(engine: Engine, steam_id: str, new_api_key: str) -> None:
     """Update an API key."""
-    with engine.connect() as conn:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
         conn.execute(
             sa.text("UPDATE api_keys SET api_key = :new_api_key WHERE steam_id = :steam_id"),
             {"steam_id": steam_id, "new_api_key": new_api_key},
         )
-        conn.commit()
+    steam_id_cache.invalidate(steam_id)
 
 
 def check_steam_id_is_beta_tester(engine: Engine, steam_id: str) -> bool:
     """Check that a given steam id has an API key or not."""
     with engine.connect() as conn:
         result = conn.execute(
-            sa.text("SELECT * FROM beta_tester_steam_ids WHERE steam_id = :steam_id"), {"steam_id": steam_id}
-        ).one_or_none()
+            sa.text("SELECT EXISTS (SELECT 1 FROM beta_tester_steam_ids WHERE steam_id = :steam_id)"),
+            {"steam_id": steam_id},
+        ).scalar_one()
 
-        return bool(result)
+        return result
 
 
 def provision_api_key(engine: Engine, steam_id: str, api_key: str) -> None:
     """Provision an API key."""
-    with engine.connect() as conn:
-        created_at = datetime.now().astimezone(timezone.utc).isoformat()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        created_at = datetime.now(timezone.utc)
         updated_at = created_at
         conn.execute(
             sa.text(
@@ -670,14 +972,14 @@ def provision_api_key(engine: Engine, steam_id: str, api_key: str) -> None:
             ),
             {"steam_id": steam_id, "api_key": api_key, "created_at": created_at, "updated_at": updated_at},
         )
-        conn.commit()
+    steam_id_cache.invalidate(steam_id)
 
 
 def add_loser(engine: Engine, steam_id: str) -> None:
     """Add a new loser to the database."""
     # see https://github.com/MegaAntiCheat/masterbase/issues/53
-    with engine.connect() as conn:
-        created_at = datetime.now().astimezone(timezone.utc).isoformat()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        created_at = datetime.now(timezone.utc)
         updated_at = created_at
         conn.execute(
             sa.text(
@@ -688,14 +990,13 @@ def add_loser(engine: Engine, steam_id: str) -> None:
             ),
             {"steam_id": steam_id, "created_at": created_at, "updated_at": updated_at},
         )
-        conn.commit()
 
 
 def add_report(engine: Engine, session_id: str, target_steam_id: str, reason: str) -> None:
     """Submit a hackusation to the database."""
     # TODO: Eventually we need to enforce more rigorous checks
-    with engine.connect() as txn:
-        created_at = datetime.now().astimezone(timezone.utc).isoformat()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as txn:
+        created_at = datetime.now(timezone.utc)
         txn.execute(
             sa.text(
                 """INSERT INTO reports (
@@ -708,17 +1009,16 @@ def add_report(engine: Engine, session_id: str, target_steam_id: str, reason: st
             ),
             {"target_steam_id": target_steam_id, "session_id": session_id, "created_at": created_at, "reason": reason},
         )
-        txn.commit()
 
 
 def check_is_loser(engine: Engine, steam_id: str) -> bool:
     """Determine if we have flagged account as a loser."""
     with engine.connect() as conn:
         result = conn.execute(
-            sa.text("SELECT COUNT(*) FROM losers WHERE steam_id = :steam_id"),
+            sa.text("SELECT EXISTS (SELECT 1 FROM losers WHERE steam_id = :steam_id)"),
             {
                 "steam_id": steam_id,
             },
-        ).scalar_one_or_none()
+        ).scalar_one()
 
-        return bool(result)
+        return result
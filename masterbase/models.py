@@ -1,8 +1,9 @@
 """Module of pydantic models."""
 
 from enum import Enum
+from typing import Any
 
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 
 
 class ReportReason(str, Enum):
@@ -27,7 +28,22 @@ class ExportTable(str, Enum):
     REPORTS = "reports"
 
 
+class ExportFormat(str, Enum):
+    """Formats to be allowed in database exports."""
+
+    CSV = "csv"
+    BINARY = "binary"
+
+
 class LateBytesBody(BaseModel):
     """Report model for late_bytes post request body."""
 
-    late_bytes: str
+    late_bytes: bytes
+
+    @field_validator("late_bytes", mode="before")
+    @classmethod
+    def decode_hex(cls, value: Any) -> Any:
+        """Decode the hex string sent by the client into raw bytes."""
+        if isinstance(value, str):
+            return bytes.fromhex(value)
+        return value
@@ -1,11 +1,15 @@
 """Functions that register state for the application."""
 
-from typing import cast
+import asyncio
+import os
+from typing import Any, cast
+from uuid import uuid4
 
 from litestar import Litestar
 from minio import Minio
 from sqlalchemy import Engine, create_engine
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from masterbase.lib import make_db_uri, make_minio_client
 
@@ -21,16 +25,60 @@ def get_minio_connection(app: Litestar) -> Minio:
     return cast(Minio, app.state.minio_client)
 
 
+def _behind_pgbouncer() -> bool:
+    """Return whether DB connections go through PgBouncer in transaction mode, flagged by `DB_BEHIND_PGBOUNCER`."""
+    return os.getenv("DB_BEHIND_PGBOUNCER", "false").lower() == "true"
+
+
+def _pool_options() -> dict[str, Any]:
+    """Pool configuration shared by both engines, tunable through `DB_POOL_*` and `DB_MAX_OVERFLOW`."""
+    behind_pgbouncer = _behind_pgbouncer()
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        # fail fast instead of queueing requests behind an exhausted pool, and retire connections before the
+        # server or anything in between drops them
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "5")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "60" if behind_pgbouncer else "1800")),
+        # PgBouncer already health checks its server connections, pinging through it only costs a round trip
+        "pool_pre_ping": not behind_pgbouncer and os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        # hand out the most recently used connection, so a few warm backends serve steady traffic and the surplus
+        # sits idle until it is recycled
+        "pool_use_lifo": True,
+    }
+
+
+def _async_connect_args() -> dict[str, Any]:
+    """Arguments for asyncpg connections; PgBouncer hands out backends that do not hold our prepared statements."""
+    if not _behind_pgbouncer():
+        return {}
+
+    return {
+        "statement_cache_size": 0,
+        "prepared_statement_cache_size": 0,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+    }
+
+
 def get_db_connection(app: Litestar) -> Engine:
     """Get the db engine.
 
     If it doesn't exist, creates it and saves it in on the application state object
     """
     if not getattr(app.state, "engine", None):
-        app.state.engine = create_engine(make_db_uri(), pool_pre_ping=True)
+        app.state.engine = create_engine(make_db_uri(), poolclass=QueuePool, **_pool_options())
     return cast("Engine", app.state.engine)
 
 
+async def warm_db_pool(app: Litestar) -> None:
+    """Open `pool_size` connections up front in worker threads so the first requests do not pay for the handshakes."""
+    engine = get_db_connection(app)
+    pool_size = cast(QueuePool, engine.pool).size()
+    connections = await asyncio.gather(*(asyncio.to_thread(engine.connect) for _ in range(pool_size)))
+    for conn in connections:
+        conn.close()
+
+
 def close_db_connection(app: Litestar) -> None:
     """Close the db connection stored in the application State object."""
     if getattr(app.state, "engine", None):
@@ -43,15 +91,34 @@ def get_async_db_connection(app: Litestar) -> AsyncEngine:
     If it doesn't exist, creates it and saves it in on the application state object
     """
     if not getattr(app.state, "async_engine", None):
-        app.state.async_engine = create_async_engine(make_db_uri(is_async=True), pool_pre_ping=True)
+        app.state.async_engine = create_async_engine(
+            make_db_uri(is_async=True),
+            poolclass=AsyncAdaptedQueuePool,
+            connect_args=_async_connect_args(),
+            **_pool_options(),
+        )
     return cast("AsyncEngine", app.state.async_engine)
 
 
+async def warm_async_db_pool(app: Litestar) -> None:
+    """Open `pool_size` connections up front so the first requests do not pay for the handshakes."""
+    engine = get_async_db_connection(app)
+    pool_size = cast(AsyncAdaptedQueuePool, engine.pool).size()
+    connections = await asyncio.gather(*(engine.connect().start() for _ in range(pool_size)))
+    await asyncio.gather(*(conn.close() for conn in connections))
+
+
 async def close_async_db_connection(app: Litestar) -> None:
     """Close the db connection stored in the application State object."""
     if getattr(app.state, "async_engine", None):
         await cast("AsyncEngine", app.state.async_engine).dispose()
 
 
-startup_registers = (get_db_connection, get_async_db_connection, get_minio_connection)
+startup_registers = (
+    get_db_connection,
+    warm_db_pool,
+    get_async_db_connection,
+    warm_async_db_pool,
+    get_minio_connection,
+)
 shutdown_registers = (close_db_connection, close_async_db_connection)
@@ -1,17 +1,42 @@
 """Library code for hitting Steam API."""
 
+import asyncio
 import json
 import os
-from functools import cache
+import time
+import tomllib
+from functools import lru_cache
+from operator import attrgetter
 from typing import Any
 
 import numpy as np
 import requests
-import toml
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
+from requests.adapters import HTTPAdapter
 
 STEAM_API_KEY_KEYNAME = "STEAM_API_KEY"
 
+# limited/existing status practically never changes, so summaries can be reused for a while
+PLAYER_SUMMARY_TTL = 3600.0
+PLAYER_SUMMARY_CACHE_SIZE = 10000
+
+# reuse TCP/TLS connections to the Steam API across calls instead of a handshake per request
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=64))
+
+
+@lru_cache(maxsize=4)
+def _read_key_file(path: str, mtime_ns: int) -> dict[str, Any]:
+    """Parse a toml or json key file, keyed on its modification time so a rewritten file is read again."""
+    with open(path, "rb") as f:
+        if path.endswith(".toml"):
+            return tomllib.load(f)
+
+        elif path.endswith(".json"):
+            return json.load(f)
+
+    return {}
+
 
 def get_steam_api_key(path_or_env_var_name: str | None = STEAM_API_KEY_KEYNAME) -> str:
     """Get a steam API key from a toml, json, or environment variable.
@@ -29,14 +54,8 @@ def get_steam_api_key(path_or_env_var_name: str | None = STEAM_API_KEY_KEYNAME)
     try:
         # attempt to load from json or toml file
         if os.path.isfile(path_or_env_var_name):
-            with open(path_or_env_var_name, "r") as f:
-                if path_or_env_var_name.endswith(".toml"):
-                    data = toml.loads(f.read())
-
-                elif path_or_env_var_name.endswith(".json"):
-                    data = json.loads(f.read())
-
-                key = data[STEAM_API_KEY_KEYNAME]
+            data = _read_key_file(path_or_env_var_name, os.stat(path_or_env_var_name).st_mtime_ns)
+            key = data[STEAM_API_KEY_KEYNAME]
 
         # attempt to load from environment variable
         else:
@@ -80,6 +99,11 @@ class Filters:
         "gameaddr",
     )
 
+    # pairs each filter with a C-level getter so building the string does not go through `getattr` per param
+    _FILTER_GETTERS = tuple((filter_param, attrgetter(filter_param)) for filter_param in FILTER_PARAMS)
+
+    __slots__ = FILTER_PARAMS + ("nor_filter", "nand_filter", "_filter_str")
+
     def __init__(
         self,
         dedicated: bool | None = None,
@@ -151,6 +175,8 @@ class Filters:
         self.nor_filter: list[str] = []
         self.nand_filter: list[str] = []
 
+        self._filter_str: str | None = None
+
     @staticmethod
     def coerce_boolean(value: bool | None) -> int | None:
         """Coerce a boolean value into an integer or do nothing if it is None.
@@ -190,8 +216,8 @@ class Filters:
             formatted filter string for the request
         """
         filters = []
-        for filter_param in self.FILTER_PARAMS:
-            attr = getattr(self, filter_param)
+        for filter_param, get_filter in self._FILTER_GETTERS:
+            attr = get_filter(self)
             if attr is None:
                 continue
 
@@ -209,8 +235,10 @@ class Filters:
 
     @property
     def filter_string(self) -> str:
-        """Return the filter string."""
-        return self._make_filter_str()
+        """Return the filter string, built once as filters are not meant to change after construction."""
+        if self._filter_str is None:
+            self._filter_str = self._make_filter_str()
+        return self._filter_str
 
     def add_nor_filter(self) -> None:
         """Add nor filter."""
@@ -293,25 +321,58 @@ class Server(BaseModel):
         """
         server_data = {}
 
-        params: dict[str, str | int] = {
-            "key": steam_api_key,
-            "fake_ip": fake_ip_as_integer,
-            "fake_port": fake_port,
-            "app_id": 440,
-        }
+        params = Server._fake_ip_params(steam_api_key, fake_ip_as_integer, fake_port)
         for query_type, query_key in QUERY_TYPES.items():
             params["query_type"] = query_type
 
-            response = requests.get(URL, params)
+            response = session.get(URL, params=params)
             server_data[query_key] = response.json()["response"][query_key]
 
         return server_data
 
+    @staticmethod
+    async def async_query_from_params(
+        steam_api_key: str, fake_ip_as_integer: int, fake_port: str | int
+    ) -> dict[str, Any]:
+        """Query for the server information like `query_from_params`, but issue the query types concurrently.
+
+        Args:
+            steam_api_key: steam api key
+            fake_ip: fake ip of server
+            fake_port: fake port of server
+        """
+        params = Server._fake_ip_params(steam_api_key, fake_ip_as_integer, fake_port)
+        responses = await asyncio.gather(
+            *(
+                asyncio.to_thread(session.get, URL, params={**params, "query_type": query_type})
+                for query_type in QUERY_TYPES
+            )
+        )
+
+        return {
+            query_key: response.json()["response"][query_key]
+            for query_key, response in zip(QUERY_TYPES.values(), responses)
+        }
+
+    @staticmethod
+    def _fake_ip_params(steam_api_key: str, fake_ip_as_integer: int, fake_port: str | int) -> dict[str, str | int]:
+        """Build the `QueryByFakeIP` params shared by every query type."""
+        return {
+            "key": steam_api_key,
+            "fake_ip": fake_ip_as_integer,
+            "fake_port": fake_port,
+            "app_id": 440,
+        }
+
     def query(self, steam_api_key: str) -> dict[str, Any]:
         """Query from self."""
         return Server.query_from_params(steam_api_key, self.ip_as_integer, self.gameport)
 
 
+# validates a whole server list with one compiled validator rather than building the models one call at a time
+_SERVER_LIST_ADAPTER = TypeAdapter(list[Server])
+
+
 class Query:
     """Object that represents a response from the api.steampowered.com/IGameServersService/GetServerList/v1 endpoint."""
 
@@ -342,8 +403,7 @@ class Query:
         if self.limit is not None:
             params["limit"] = self.limit
 
-        full_url = rf"{self.URL}?key={params['key']}&filter={filters.filter_string}"
-        response = requests.get(full_url)
+        response = session.get(self.URL, params=params)
 
         return response.json()["response"]
 
@@ -354,21 +414,30 @@ class Query:
         if not response:
             raise ValueError("Query returned no servers!")
 
-        servers = [Server(**server) for server in response["servers"]]
+        servers = _SERVER_LIST_ADAPTER.validate_python(response["servers"])
 
         return servers
 
 
-@cache
+_player_summaries: dict[str, tuple[float, dict[str, str | int]]] = {}
+
+
 def player_summary(steam_id: str) -> dict[str, str | int]:
-    """Retrieve a player summary."""
+    """Retrieve a player summary, cached for `PLAYER_SUMMARY_TTL` seconds."""
+    entry = _player_summaries.get(steam_id)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+
     url = "https://api.steampowered.com/ISteamUser/GetPlayerSummaries/v2"
     params = {"key": get_steam_api_key(), "steamids": steam_id}
-    response = requests.get(url, params).json()
-    if len(response["response"]["players"]) > 0:
-        return response["response"]["players"][0]
-    else:
-        return {}
+    response = session.get(url, params=params).json()
+    players = response["response"]["players"]
+    summary = players[0] if players else {}
+
+    if len(_player_summaries) >= PLAYER_SUMMARY_CACHE_SIZE and steam_id not in _player_summaries:
+        _player_summaries.pop(next(iter(_player_summaries)), None)
+    _player_summaries[steam_id] = (time.monotonic() + PLAYER_SUMMARY_TTL, summary)
+    return summary
 
 
 def is_limited_account(steam_id: str) -> bool:
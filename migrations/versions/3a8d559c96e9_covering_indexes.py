@@ -0,0 +1,49 @@
+"""covering_indexes
+
+Revision ID: 3a8d559c96e9
+Revises: 82f4e558463f
+Create Date: 2026-10-16 11:02:17.904613
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3a8d559c96e9"
+down_revision: Union[str, None] = "82f4e558463f"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Add covering indexes for API key lookups and latest session lookups."""
+    # built concurrently so that API key lookups, which every request makes, are not blocked
+    with op.get_context().autocommit_block():
+        op.execute(
+            """
+            CREATE UNIQUE INDEX CONCURRENTLY api_keys_api_key_covering_idx ON api_keys (api_key) INCLUDE (steam_id);
+            """
+        )
+        op.execute(
+            """
+            CREATE INDEX CONCURRENTLY demo_sessions_steam_id_start_time_idx
+            ON demo_sessions (steam_id, start_time DESC) INCLUDE (session_id);
+            """
+        )
+
+
+def downgrade() -> None:
+    """Drop the covering indexes."""
+    with op.get_context().autocommit_block():
+        op.execute(
+            """
+            DROP INDEX CONCURRENTLY demo_sessions_steam_id_start_time_idx;
+            """
+        )
+        op.execute(
+            """
+            DROP INDEX CONCURRENTLY api_keys_api_key_covering_idx;
+            """
+        )
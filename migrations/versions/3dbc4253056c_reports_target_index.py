@@ -0,0 +1,38 @@
+"""reports_target_index
+
+Revision ID: 3dbc4253056c
+Revises: a8257c1ffadc
+Create Date: 2026-10-16 16:48:32.410277
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3dbc4253056c"
+down_revision: Union[str, None] = "a8257c1ffadc"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Index reports by the player they were made against."""
+    # the primary key leads with session_id, so looking up every report against a player would scan the table
+    with op.get_context().autocommit_block():
+        op.execute(
+            """
+            CREATE INDEX CONCURRENTLY reports_target_steam_id_idx ON reports (target_steam_id);
+            """
+        )
+
+
+def downgrade() -> None:
+    """Drop the reports target index."""
+    with op.get_context().autocommit_block():
+        op.execute(
+            """
+            DROP INDEX CONCURRENTLY reports_target_steam_id_idx;
+            """
+        )
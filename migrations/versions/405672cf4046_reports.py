@@ -8,7 +8,6 @@ Create Date: 2024-05-20 19:51:50.881864
 
 from typing import Sequence, Union
 
-import sqlalchemy as sa
 from alembic import op
 
 # revision identifiers, used by Alembic.
@@ -8,7 +8,6 @@ Create Date: 2023-12-30 16:24:24.579092
 
 from typing import Sequence, Union
 
-import sqlalchemy as sa
 from alembic import op
 
 # revision identifiers, used by Alembic.
@@ -8,7 +8,6 @@ Create Date: 2024-06-12 20:10:56.301439
 from typing import Sequence, Union
 
 from alembic import op
-import sqlalchemy as sa
 
 
 # revision identifiers, used by Alembic.
@@ -21,24 +20,20 @@ depends_on: Union[str, Sequence[str], None] = None
 def upgrade() -> None:
     """Add the blob_name column to the demo_sessions table."""
     op.execute(
-        sa.text(
-            """
+        """
         ALTER TABLE demo_sessions
         ADD COLUMN blob_name TEXT,
         DROP COLUMN demo_oid;
         """
-        )
     )
 
 
 def downgrade() -> None:
     """Drop the blob_name column from the demo_sessions table."""
     op.execute(
-        sa.text(
-            """
+        """
         ALTER TABLE demo_sessions
         DROP COLUMN blob_name,
         ADD COLUMN demo_oid oid;
         """
-        )
     )
\ No newline at end of file
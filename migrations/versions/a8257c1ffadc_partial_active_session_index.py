@@ -0,0 +1,38 @@
+"""partial_active_session_index
+
+Revision ID: a8257c1ffadc
+Revises: 3a8d559c96e9
+Create Date: 2026-10-16 14:21:05.118402
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a8257c1ffadc"
+down_revision: Union[str, None] = "3a8d559c96e9"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Index active demo sessions by user."""
+    # a user has at most one active session, so this stays tiny however many closed sessions pile up
+    with op.get_context().autocommit_block():
+        op.execute(
+            """
+            CREATE INDEX CONCURRENTLY demo_sessions_active_steam_id_idx ON demo_sessions (steam_id) WHERE active;
+            """
+        )
+
+
+def downgrade() -> None:
+    """Drop the active demo session index."""
+    with op.get_context().autocommit_block():
+        op.execute(
+            """
+            DROP INDEX CONCURRENTLY demo_sessions_active_steam_id_idx;
+            """
+        )
@@ -8,7 +8,6 @@ Create Date: 2024-06-07 16:49:45.487922
 from typing import Sequence, Union
 
 from alembic import op
-import sqlalchemy as sa
 
 
 # revision identifiers, used by Alembic.
@@ -1,7 +1,10 @@
 """Integration tests."""
 
+import asyncio
 import csv
+import gzip
 import io
+import os
 import time
 from typing import Iterator
 
@@ -9,11 +12,32 @@ import pytest
 import sqlalchemy as sa
 from httpx import Response
 from litestar import Litestar
-from litestar.status_codes import HTTP_200_OK, HTTP_201_CREATED, HTTP_403_FORBIDDEN
+from litestar.exceptions import WebSocketDisconnect
+from litestar.status_codes import (
+    HTTP_200_OK,
+    HTTP_201_CREATED,
+    HTTP_400_BAD_REQUEST,
+    HTTP_403_FORBIDDEN,
+    HTTP_422_UNPROCESSABLE_ENTITY,
+    HTTP_500_INTERNAL_SERVER_ERROR,
+)
 from litestar.testing import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import QueuePool
 
+import masterbase.lib
 from masterbase.app import app
-from masterbase.lib import LATE_BYTES_END, LATE_BYTES_START, add_report
+from masterbase.lib import (
+    LATE_BYTES_END,
+    LATE_BYTES_START,
+    add_report,
+    anonymizer,
+    db_export_chunks,
+    demo_blob_name,
+    demo_sink_path,
+    make_db_uri,
+    open_streaming_session,
+)
 from masterbase.models import ReportReason
 
 pytestmark = pytest.mark.integration
@@ -128,6 +152,44 @@ def test_demo_streaming(test_client: TestClient[Litestar], api_key: str) -> None
         assert demo_in == demo_out
 
 
+def test_late_bytes_only_touch_active_session(test_client: TestClient[Litestar], api_key: str) -> None:
+    """Test that late bytes are written to the active session only, and only once."""
+    closed_session_id = str(_open_mock_session(test_client, api_key).json()["session_id"])
+    test_client.get("/close_session", params={"api_key": api_key})
+    session_id = str(_open_mock_session(test_client, api_key).json()["session_id"])
+
+    late_bytes_hex = "7031cf44a7af0100cea70100f5e00400"
+    params = {"api_key": api_key}
+    response = test_client.post("/late_bytes", params=params, json={"late_bytes": "not hex"})
+    assert response.status_code == HTTP_400_BAD_REQUEST
+    response = test_client.post("/late_bytes", params=params, json={"late_bytes": late_bytes_hex})
+    assert response.status_code == HTTP_201_CREATED
+    response = test_client.post("/late_bytes", params=params, json={"late_bytes": late_bytes_hex})
+    assert response.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+
+    with test_client.app.state.engine.connect() as conn:
+        sql = "SELECT session_id, encode(late_bytes, 'hex') FROM demo_sessions WHERE session_id IN (:closed, :active);"
+        rows = dict(conn.execute(sa.text(sql), {"closed": closed_session_id, "active": session_id}).all())
+    assert rows == {closed_session_id: None, session_id: late_bytes_hex}
+
+    test_client.get("/close_session", params={"api_key": api_key})
+
+
+def test_list_demos(test_client: TestClient[Litestar], api_key: str, steam_id: str) -> None:
+    """Test listing closed demos with anonymized owners."""
+    session_id = str(_open_mock_session(test_client, api_key).json()["session_id"])
+    test_client.get("/close_session", params={"api_key": api_key})
+
+    for endpoint in ("/list_demos", "/analyst_list_demos"):
+        response = test_client.get(endpoint, params={"api_key": api_key, "page_size": 49})
+        assert response.status_code == HTTP_200_OK
+        demos = response.json()
+        assert session_id in {demo["session_id"] for demo in demos}
+        for demo in demos:
+            assert "steam_id" not in demo
+            assert demo["anonymous_id"] == anonymizer(steam_id.encode())(steam_id)
+
+
 def test_demo_streaming_no_late(test_client: TestClient[Litestar], api_key: str) -> None:
     """Test streaming a demo to the database without a header overwrite."""
     session_id = _open_mock_session(test_client, api_key).json()["session_id"]
@@ -146,6 +208,95 @@ def test_demo_streaming_no_late(test_client: TestClient[Litestar], api_key: str)
         assert demo_in == demo_out
 
 
+def test_demo_upload_retried_on_next_close(
+    test_client: TestClient[Litestar], api_key: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that a demo whose upload failed is kept on disk and uploaded by the next close."""
+    session_id = str(_open_mock_session(test_client, api_key).json()["session_id"])
+    _send_demo_file(test_client, api_key, session_id)
+
+    def _fail_upload(*args: object) -> None:
+        raise ConnectionError("blob storage is down")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(masterbase.lib, "_upload_demo", _fail_upload)
+        close_session_response = test_client.get("/close_session", params={"api_key": api_key})
+    assert close_session_response.status_code == HTTP_500_INTERNAL_SERVER_ERROR
+
+    sql = "SELECT active, markov_score, blob_name FROM demo_sessions WHERE session_id = :session_id;"
+    with test_client.app.state.engine.connect() as conn:
+        active, markov_score, blob_name = conn.execute(sa.text(sql), {"session_id": session_id}).one()
+    assert not active and markov_score is not None and blob_name is None
+    assert os.path.exists(demo_sink_path(session_id))
+
+    _open_mock_session(test_client, api_key)
+    close_session_response = test_client.get("/close_session", params={"api_key": api_key})
+    assert close_session_response.status_code == HTTP_200_OK
+
+    with test_client.app.state.engine.connect() as conn:
+        _, _, blob_name = conn.execute(sa.text(sql), {"session_id": session_id}).one()
+    assert blob_name == demo_blob_name(session_id)
+    assert not os.path.exists(demo_sink_path(session_id))
+
+    with test_client.stream("GET", "/demodata", params={"api_key": api_key, "session_id": session_id}) as demo_stream:
+        demo_out = demo_stream.read()
+
+    with open("tests/data/test_demo.dem", "rb") as f:
+        assert f.read() == demo_out
+
+
+def test_demo_streaming_bad_key(test_client: TestClient[Litestar], api_key: str) -> None:
+    """Test that sockets with an unknown API key are closed."""
+    session_id = str(_open_mock_session(test_client, api_key).json()["session_id"])
+
+    with pytest.raises(WebSocketDisconnect):
+        with test_client.websocket_connect("/demos", params={"api_key": "not-a-key", "session_id": session_id}) as bad:
+            bad.receive_bytes()
+
+    test_client.get("/close_session", params={"api_key": api_key})
+
+
+def test_open_streaming_session(test_client: TestClient[Litestar], api_key: str) -> None:
+    """Test that a session can only be opened for streaming once, with a valid key, while it is active."""
+
+    async def open_twice(session_id: str) -> list[str | None]:
+        engine = create_async_engine(make_db_uri(is_async=True))
+        try:
+            return [
+                await open_streaming_session(engine, "not-a-key", session_id),
+                await open_streaming_session(engine, api_key, session_id),
+                await open_streaming_session(engine, api_key, session_id),
+            ]
+        finally:
+            await engine.dispose()
+
+    session_id = str(_open_mock_session(test_client, api_key).json()["session_id"])
+    assert asyncio.run(open_twice(session_id)) == ["Invalid API key", None, "User is already streaming data"]
+    test_client.get("/close_session", params={"api_key": api_key})
+    assert asyncio.run(open_twice(session_id))[1] == "User is not in a session"
+
+
+def test_demo_streaming_close_while_connected(test_client: TestClient[Litestar], api_key: str) -> None:
+    """Test that closing a session whose socket is still streaming uploads every byte sent so far."""
+    session_id = _open_mock_session(test_client, api_key).json()["session_id"]
+
+    with open("tests/data/test_demo.dem", "rb") as f:
+        demo_in = f.read()
+
+    with test_client.websocket_connect("/demos", params={"api_key": api_key, "session_id": session_id}) as socket:
+        time.sleep(5)
+        for start in range(0, len(demo_in), 1 << 16):
+            socket.send_bytes(demo_in[start : start + (1 << 16)])
+        time.sleep(1)
+        close_session_response = test_client.get("/close_session", params={"api_key": api_key})
+        assert close_session_response.status_code == HTTP_200_OK
+
+    with test_client.stream("GET", "/demodata", params={"api_key": api_key, "session_id": session_id}) as demo_stream:
+        demo_out = demo_stream.read()
+
+    assert demo_in == demo_out
+
+
 def test_db_exports(test_client: TestClient[Litestar], api_key: str) -> None:
     """Test on-demand exports from the database."""
     session_id = str(_open_mock_session(test_client, api_key).json()["session_id"])
@@ -173,6 +324,52 @@ def test_db_exports(test_client: TestClient[Litestar], api_key: str) -> None:
     assert tuple(expected) == tuple(returned)
 
 
+def test_db_exports_compressed(test_client: TestClient[Litestar], api_key: str) -> None:
+    """Test that compressed exports decompress to the plain export."""
+    for export_format in ("csv", "binary"):
+        params = {"api_key": api_key, "table": "reports", "format": export_format}
+        plain = test_client.get("/db_export", params=params)
+        compressed = test_client.get("/db_export", params={**params, "compress": True})
+        assert compressed.headers["Content-Type"] == "application/gzip"
+        assert gzip.decompress(compressed.content) == plain.content
+
+
+def test_db_exports_binary(test_client: TestClient[Litestar], api_key: str) -> None:
+    """Test that binary exports are a valid PGCOPY stream."""
+    params = {"api_key": api_key, "table": "reports", "format": "binary"}
+    response = test_client.get("/db_export", params=params)
+    assert response.headers["Content-Type"] == "application/octet-stream"
+    assert response.content.startswith(b"PGCOPY\n\xff\r\n\x00")
+
+
+def test_db_export_client_disconnect(test_client: TestClient[Litestar]) -> None:
+    """Test that abandoning an export mid-stream cancels its COPY and returns the connection."""
+    with test_client.app.state.engine.connect() as conn:
+        conn.execute(
+            sa.text("CREATE TABLE export_test AS SELECT g, md5(g::text) AS h FROM generate_series(1, 200000) AS g;")
+        )
+        conn.commit()
+
+    async def abandon_export() -> None:
+        engine = create_async_engine(make_db_uri(is_async=True))
+        try:
+            chunks = db_export_chunks(engine, "export_test")
+            assert await anext(chunks)
+            await chunks.aclose()
+            await asyncio.sleep(0.5)
+            assert asyncio.all_tasks() == {asyncio.current_task()}
+            assert isinstance(engine.pool, QueuePool) and engine.pool.checkedout() == 0
+        finally:
+            await engine.dispose()
+
+    try:
+        asyncio.run(abandon_export())
+    finally:
+        with test_client.app.state.engine.connect() as conn:
+            conn.execute(sa.text("DROP TABLE export_test;"))
+            conn.commit()
+
+
 def test_upsert_report_reason(test_client: TestClient[Litestar], api_key: str) -> None:
     """Ensure that upserts of reports during the same session work as intended."""
     session_id = str(_open_mock_session(test_client, api_key).json()["session_id"])
@@ -1,14 +1,32 @@
 """Test api utilities."""
 
+import asyncio
+import base64
+import hashlib
 import io
 import os
 import random
+from threading import Thread
+from typing import cast
+from uuid import RFC_4122, UUID
 
 import numpy as np
 import pytest
+from litestar import WebSocket
 
 from masterbase.anomaly import DetectionState
-from masterbase.lib import DEMOS_PATH, ConcatStream, DemoSessionManager, generate_uuid4_int, make_db_uri
+from masterbase.lib import (
+    DEMO_WRITE_QUEUE_SIZE,
+    DEMOS_PATH,
+    ConcatStream,
+    DemoSessionManager,
+    SessionRegistry,
+    SteamIDCache,
+    anonymizer,
+    generate_api_key,
+    generate_uuid4_int,
+    make_db_uri,
+)
 
 
 @pytest.fixture(scope="session")
@@ -45,6 +63,120 @@ def test_make_demo_path(session_id: str) -> None:
     assert manager.demo_path == os.path.join(DEMOS_PATH, f"{session_id}.dem")
 
 
+def test_demo_session_manager_writes(session_id: str) -> None:
+    """Test that data queued through `DemoSessionManager.update` lands on disk in order by `disconnect`."""
+    manager = DemoSessionManager(session_id=session_id, detection_state=DetectionState())
+    chunks = [random.randbytes(random.randint(1, 1 << 16)) for _ in range(256)]
+    manager.set_demo_handle("wb")
+    try:
+        for chunk in chunks:
+            manager.update(chunk)
+        manager.disconnect()
+        with open(manager.demo_path, "rb") as f:
+            assert f.read() == b"".join(chunks)
+        assert manager.detection_state.length == sum(map(len, chunks))
+    finally:
+        os.remove(manager.demo_path)
+
+
+def test_demo_session_manager_async_writes(session_id: str) -> None:
+    """Test that `DemoSessionManager.async_update` keeps chunk order when it has to wait on a full queue."""
+    manager = DemoSessionManager(session_id=session_id, detection_state=DetectionState())
+    chunks = [random.randbytes(1 << 12) for _ in range(1024)]
+
+    async def stream() -> None:
+        for chunk in chunks:
+            await manager.async_update(chunk)
+
+    manager.set_demo_handle("wb")
+    try:
+        asyncio.run(stream())
+        manager.disconnect()
+        with open(manager.demo_path, "rb") as f:
+            assert f.read() == b"".join(chunks)
+    finally:
+        os.remove(manager.demo_path)
+
+
+def test_demo_session_manager_write_error(session_id: str) -> None:
+    """Test that a failed demo write stops the stream but still lets the session be disconnected."""
+    manager = DemoSessionManager(session_id=session_id, detection_state=DetectionState())
+    manager.set_demo_handle("wb")
+    manager.handle.close()
+    manager.handle = open(manager.demo_path, "rb")
+    try:
+        manager.update(b"\x00" * 16)
+        manager.disconnect()
+        manager.disconnect()
+        with pytest.raises(OSError):
+            manager.update(b"\x00" * 16)
+    finally:
+        os.remove(manager.demo_path)
+
+
+def test_demo_session_manager_rejects_updates_after_disconnect(session_id: str) -> None:
+    """Test that data sent after a disconnect is refused instead of queueing behind a writer that has stopped."""
+    manager = DemoSessionManager(session_id=session_id, detection_state=DetectionState())
+    manager.set_demo_handle("wb")
+
+    async def stream() -> None:
+        for _ in range(DEMO_WRITE_QUEUE_SIZE + 8):
+            with pytest.raises(ValueError):
+                await manager.async_update(b"\x00" * 16)
+
+    try:
+        manager.update(b"\x01" * 16)
+        manager.disconnect()
+        for _ in range(DEMO_WRITE_QUEUE_SIZE + 8):
+            with pytest.raises(ValueError):
+                manager.update(b"\x00" * 16)
+        asyncio.run(stream())
+        with open(manager.demo_path, "rb") as f:
+            assert f.read() == b"\x01" * 16
+    finally:
+        os.remove(manager.demo_path)
+
+
+def test_demo_session_manager_concurrent_disconnects(session_id: str) -> None:
+    """Test that racing disconnects on a full queue send one sentinel and both wait for the demo to be written."""
+    manager = DemoSessionManager(session_id=session_id, detection_state=DetectionState())
+    chunks = [random.randbytes(1 << 12) for _ in range(DEMO_WRITE_QUEUE_SIZE)]
+    manager.set_demo_handle("wb")
+    try:
+        for chunk in chunks:
+            manager.update(chunk)
+        disconnects = [Thread(target=manager.disconnect) for _ in range(2)]
+        for disconnect in disconnects:
+            disconnect.start()
+        for disconnect in disconnects:
+            disconnect.join(timeout=10)
+            assert not disconnect.is_alive()
+        assert manager._writes.empty()
+        with open(manager.demo_path, "rb") as f:
+            assert f.read() == b"".join(chunks)
+    finally:
+        os.remove(manager.demo_path)
+
+
+def test_session_registry(session_id: str) -> None:
+    """Test that `SessionRegistry` keeps its reverse index in step with its sockets."""
+    registry = SessionRegistry()
+    socket, other_socket = cast(WebSocket, object()), cast(WebSocket, object())
+    manager = DemoSessionManager(session_id=session_id, detection_state=DetectionState())
+    other_manager = DemoSessionManager(session_id=f"{session_id}0", detection_state=DetectionState())
+
+    registry[socket] = manager
+    registry[other_socket] = other_manager
+    assert len(registry) == 2
+    assert registry[socket] is manager
+    assert registry.get_by_session_id(session_id) == (socket, manager)
+
+    assert registry.pop(socket) is manager
+    assert socket not in registry
+    assert registry.get_by_session_id(session_id) is None
+    assert registry.get_by_session_id(other_manager.session_id) == (other_socket, other_manager)
+
+
 def test_concat_stream_bounds() -> None:
     """Test ConcatStream, in particular its handling of random stream boundaries."""
     # concatenate ten "streams"
@@ -68,3 +200,72 @@ def test_concat_stream_bounds() -> None:
         read += chunk
     read += strm.read()
     assert read == data
+
+
+def test_concat_stream_readinto() -> None:
+    """Test that ConcatStream.readinto fills the buffer across stream boundaries."""
+    strm = ConcatStream(io.BytesIO(b"abc"), io.BytesIO(b""), io.BytesIO(b"defg"))
+    buffer = bytearray(5)
+    assert strm.readinto(buffer) == 5
+    assert buffer == b"abcde"
+    assert strm.readinto(buffer) == 2
+    assert buffer[:2] == b"fg"
+    assert strm.readinto(buffer) == 0
+
+
+def test_anonymizer() -> None:
+    """Test that anonymous IDs are stable per (demo, requester) pair and differ across requesters."""
+    demo_steam_id = "76561198000000001"
+    requester_key = b"76561198000000002"
+    anonymous_id = anonymizer(requester_key)(demo_steam_id)
+    assert anonymous_id == anonymizer(requester_key)(demo_steam_id)
+    assert len(anonymous_id) == 32
+    assert anonymous_id != anonymizer(b"76561198000000003")(demo_steam_id)
+    assert anonymous_id != anonymizer(requester_key)("76561198000000004")
+
+
+def test_anonymizer_matches_one_shot_hash() -> None:
+    """Test that reusing a requester's keyed state gives the same IDs as hashing from scratch."""
+    requester_key = b"76561198000000002"
+    anonymize = anonymizer(requester_key)
+    for steam_id in ("76561198000000001", "76561198000000004", "76561198000000001"):
+        assert anonymize(steam_id) == hashlib.blake2b(steam_id.encode(), key=requester_key, digest_size=16).hexdigest()
+
+
+def test_steam_id_cache() -> None:
+    """Test SteamIDCache expiry, eviction and invalidation."""
+    cache = SteamIDCache(ttl=60, maxsize=2)
+    cache.set("key-a", "steam-a")
+    cache.set("key-b", "steam-b")
+    assert cache.get("key-a") == "steam-a"
+
+    cache.set("key-c", "steam-c")
+    assert cache.get("key-a") is None
+    assert cache.get("key-b") == "steam-b"
+
+    cache.invalidate("steam-b")
+    assert cache.get("key-b") is None
+    assert cache.get("key-c") == "steam-c"
+
+    expired = SteamIDCache(ttl=0)
+    expired.set("key-a", "steam-a")
+    assert expired.get("key-a") is None
+
+
+def test_generate_api_key() -> None:
+    """Test API keys are a prefix on 32 random bytes of unpadded urlsafe base64."""
+    api_key = generate_api_key()
+    assert api_key.startswith("MB-")
+    assert len(api_key) == len("MB-") + 43
+    assert len(base64.urlsafe_b64decode(api_key.removeprefix("MB-") + "=")) == 32
+    assert api_key != generate_api_key()
+
+
+def test_generate_uuid4_int() -> None:
+    """Test session IDs are valid, distinct version 4 UUIDs."""
+    session_ids = {generate_uuid4_int() for _ in range(1000)}
+    assert len(session_ids) == 1000
+    for session_id in session_ids:
+        uuid = UUID(int=session_id)
+        assert uuid.version == 4
+        assert uuid.variant == RFC_4122
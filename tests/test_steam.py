@@ -1,5 +1,6 @@
 """Test steam api code."""
 
+import asyncio
 import json
 import os
 import random
@@ -9,6 +10,7 @@ from uuid import uuid4
 import pytest
 import toml
 
+from masterbase import steam
 from masterbase.steam import STEAM_API_KEY_KEYNAME, Filters, get_ip_as_integer, get_steam_api_key
 
 
@@ -71,6 +73,18 @@ def test_get_steam_api_key(steam_id: str, tmpdir: os.PathLike) -> None:
         get_steam_api_key(key_location)
 
 
+def test_get_steam_api_key_rereads_rewritten_file(steam_id: str, tmpdir: os.PathLike) -> None:
+    """Test that a cached key file is read again once it is rewritten."""
+    key_location = write_json_steam_id(steam_id, tmpdir)
+    assert get_steam_api_key(key_location) == steam_id
+
+    new_steam_id = str(uuid4().int)
+    write_json_steam_id(new_steam_id, tmpdir)
+    mtime_ns = os.stat(key_location).st_mtime_ns + 1_000_000_000
+    os.utime(key_location, ns=(mtime_ns, mtime_ns))
+    assert get_steam_api_key(key_location) == new_steam_id
+
+
 def test_serialize_ip_as_int(int_32: int) -> None:
     """Test ``get_ip_as_integer``."""
     ip_str = ".".join(f"{b}" for b in int_32.to_bytes(4, "big"))
@@ -112,3 +126,72 @@ def test_filters(kwargs: dict[str, Any], expected: str) -> None:
 
     actual = filters._make_filter_str()
     assert actual == expected
+    assert filters.filter_string == expected
+    assert filters.filter_string is filters.filter_string
+
+
+def test_player_summary_is_cached(steam_id: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that player summaries are reused until they expire."""
+    calls = []
+
+    class FakeResponse:
+        def json(self) -> dict[str, Any]:
+            return {"response": {"players": [{"steamid": steam_id, "profilestate": 1}]}}
+
+    def fake_get(url: str, params: dict[str, str]) -> FakeResponse:
+        calls.append(params["steamids"])
+        return FakeResponse()
+
+    monkeypatch.setenv(STEAM_API_KEY_KEYNAME, "key")
+    monkeypatch.setattr(steam.session, "get", fake_get)
+    monkeypatch.setattr(steam, "_player_summaries", {})
+
+    assert steam.account_exists(steam_id)
+    assert not steam.is_limited_account(steam_id)
+    assert calls == [steam_id]
+
+    monkeypatch.setattr(steam, "PLAYER_SUMMARY_TTL", -1.0)
+    steam._player_summaries.clear()
+    steam.player_summary(steam_id)
+    steam.player_summary(steam_id)
+    assert calls == [steam_id] * 3
+
+
+def test_async_query_from_params_matches_sync(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that querying the query types concurrently returns the same data as querying them in turn."""
+
+    class FakeResponse:
+        def __init__(self, query_type: int) -> None:
+            self.query_type = query_type
+
+        def json(self) -> dict[str, Any]:
+            query_key = steam.QUERY_TYPES[self.query_type]
+            return {"response": {query_key: {"query_type": self.query_type}}}
+
+    def fake_get(url: str, params: dict[str, str | int]) -> FakeResponse:
+        return FakeResponse(int(params["query_type"]))
+
+    monkeypatch.setattr(steam.session, "get", fake_get)
+
+    expected = steam.Server.query_from_params("key", 1, 27015)
+    actual = asyncio.run(steam.Server.async_query_from_params("key", 1, 27015))
+    assert actual == expected
+    assert list(actual) == list(steam.QUERY_TYPES.values())
+
+
+def test_query_sends_filter_and_limit(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that `Query` hands its filter and limit to Steam as query params."""
+    requested = []
+
+    class FakeResponse:
+        def json(self) -> dict[str, Any]:
+            return {"response": {}}
+
+    def fake_get(url: str, params: dict[str, str | int]) -> FakeResponse:
+        requested.append((url, params))
+        return FakeResponse()
+
+    monkeypatch.setattr(steam.session, "get", fake_get)
+
+    steam.Query("key", {"gameaddr": "127.0.0.1:27015"}, limit=3)._query()
+    assert requested == [(steam.Query.URL, {"key": "key", "filter": r"\gameaddr\127.0.0.1:27015", "limit": 3})]